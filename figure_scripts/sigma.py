@@ -104,6 +104,9 @@ if __name__ == "__main__":
         lr=1e-4,
         end_lr=1e-5,
         restarts=0,
+        lr_schedule="log_linear",
+        warmup_epochs=0,
+        restart_mult=1,
         beta1=0.5,
         beta2=0.99,
         weight_decay=5e-4,
@@ -13,7 +13,11 @@ from tqdm import tqdm
 from sklearn import metrics as mt
 from numpy import newaxis
 from random import seed as rseed
-from torchlib.utils import stats_table, Arguments  # pylint:disable=import-error
+from torchlib.utils import (  # pylint:disable=import-error
+    stats_table,
+    Arguments,
+    matthews_from_confusion,
+)
 from torchlib.models import vgg16, resnet18, conv_at_resolution
 from torchlib.dataloader import AlbumentationsTorchTransform, CombinedLoader
 
@@ -184,7 +188,7 @@ if __name__ == "__main__":
             conf_matrix,
             report,
             roc_auc=roc_auc,
-            matthews_coeff=mt.matthews_corrcoef(total_target, total_pred),
+            matthews_coeff=matthews_from_confusion(conf_matrix),
             class_names=class_names,
             epoch=0,
         )
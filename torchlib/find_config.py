@@ -40,6 +40,9 @@ def objective(trial: opt.trial):
         lr=lr,
         end_lr=trial.suggest_loguniform("end_lr", 1e-6, lr),
         restarts=trial.suggest_int("restarts", 0, 1),
+        lr_schedule="log_linear",
+        warmup_epochs=0,
+        restart_mult=1,
         beta1=trial.suggest_float("beta1", 0.25, 0.95),
         beta2=trial.suggest_float("beta2", 0.9, 1.0),
         ## zero not possible but loguniform makes most sense
@@ -1,3 +1,4 @@
+import atexit
 import multiprocessing as mp
 from os import makedirs
 from os.path import isfile, split, isdir, join
@@ -8,18 +9,21 @@ from typing import List, Optional, Tuple, Union
 import numpy as np
 import pandas as pd
 import torch
+import torch.nn.functional as F
 
 
 import tqdm
 import albumentations as a
 from sklearn import metrics as mt
 import syft as sy
-import syft.frameworks.torch.fl.utils as syft_fl_utils
-from syft.frameworks.torch.fl.utils import add_model, scale_model
 from tabulate import tabulate
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser, NoOptionError
+from csv import DictWriter, reader
 from copy import deepcopy
-from warnings import warn, filterwarnings
+from functools import lru_cache, partial
+from warnings import catch_warnings, warn, filterwarnings
 from torchvision import datasets, transforms
 
 from .dataloader import (
@@ -39,6 +43,18 @@ class LearningRateScheduler:
     Available schedule plans:
     log_linear : Linear interpolation with log learning rate scale
     log_cosine : Cosine interpolation with log learning rate scale
+    cosine_warm_restarts : Optional geometric warmup followed by cosine
+        annealing cycles of length T_0, T_0 * T_mult, T_0 * T_mult ** 2, ...
+        If T_0 is not given, it is chosen such that restarts + 1 cycles fill
+        the epochs after the warmup.
+
+    warmup_epochs, log_warmup_start_lr, T_0 and T_mult only apply to
+    cosine_warm_restarts, a warmup is rejected for the other plans.
+
+    The schedule is evaluated once for every integer epoch at construction.
+    Fractional epochs are evaluated in closed form for the log schedules and
+    interpolated on the log scale between the integer points of a cycle for
+    cosine_warm_restarts.
     """
 
     def __init__(
@@ -48,33 +64,112 @@ class LearningRateScheduler:
         log_end_lr: float,
         schedule_plan: str = "log_linear",
         restarts: Optional[int] = None,
+        warmup_epochs: int = 0,
+        log_warmup_start_lr: Optional[float] = None,
+        T_0: Optional[int] = None,
+        T_mult: int = 1,
+        optimizer: Optional[torch.optim.Optimizer] = None,
     ):
         if restarts == 0:
             restarts = None
-        self.total_epochs = (
-            total_epochs if not restarts else total_epochs / (restarts + 1)
-        )
+        assert (
+            not warmup_epochs or schedule_plan == "cosine_warm_restarts"
+        ), "warmup is only supported by cosine_warm_restarts"
+        if schedule_plan == "cosine_warm_restarts":
+            # restarts are part of the schedule itself
+            self.total_epochs = total_epochs
+        else:
+            self.total_epochs = (
+                total_epochs if not restarts else total_epochs / (restarts + 1)
+            )
+        self._epoch_grid = np.arange(0, int(np.ceil(self.total_epochs)) + 1)
+        # position of every integer epoch within its cycle, this is fractional
+        # when the restarts do not divide the epochs
+        epoch_phases = np.arange(total_epochs + 1) % self.total_epochs
+        lr_at = None
         if schedule_plan == "log_linear":
-            self.calc_lr = lambda epoch: np.power(
+            lr_at = lambda epoch: np.power(
                 10,
                 ((log_end_lr - log_start_lr) / self.total_epochs) * epoch
                 + log_start_lr,
             )
         elif schedule_plan == "log_cosine":
-            self.calc_lr = lambda epoch: np.power(
+            lr_at = lambda epoch: np.power(
                 10,
                 (np.cos(np.pi * (epoch / self.total_epochs)) / 2.0 + 0.5)
                 * abs(log_start_lr - log_end_lr)
                 + log_end_lr,
             )
+        elif schedule_plan == "cosine_warm_restarts":
+            assert 0 <= warmup_epochs < total_epochs, "warmup exceeds schedule"
+            assert T_mult >= 1, "T_mult needs to be at least 1"
+            if log_warmup_start_lr is None:
+                log_warmup_start_lr = log_end_lr
+            if T_0 is None:
+                # T_0 * (1 + T_mult + ... + T_mult ** restarts) == remaining epochs
+                cycle_units = sum(T_mult**i for i in range((restarts or 0) + 1))
+                T_0 = max(int(np.ceil((total_epochs - warmup_epochs) / cycle_units)), 1)
+            base_lr, eta_min = np.power(10.0, log_start_lr), np.power(10.0, log_end_lr)
+            # geometric warmup == linear interpolation on the log scale
+            warmup = np.power(
+                10,
+                (log_start_lr - log_warmup_start_lr)
+                * np.arange(warmup_epochs)
+                / max(warmup_epochs, 1)
+                + log_warmup_start_lr,
+            )
+            cycles, T_i, n = [], T_0, len(self._epoch_grid) - warmup_epochs
+            while n > 0:
+                t = np.arange(min(T_i, n))
+                cycles.append(
+                    eta_min
+                    + 0.5 * (base_lr - eta_min) * (1.0 + np.cos(np.pi * t / T_i))
+                )
+                n -= T_i
+                T_i *= T_mult
+            self._lr_table = np.concatenate([warmup] + cycles)
         else:
             raise NotImplementedError(
                 "Requested learning rate schedule {} not implemented".format(
                     schedule_plan
                 )
             )
+        self._lr_at = lr_at
+        if lr_at is not None:
+            self._lr_table = lr_at(self._epoch_grid)
+            self._epoch_lr_table = lr_at(epoch_phases)
+        else:
+            self._epoch_lr_table = self._lr_table[epoch_phases.astype(int)]
+        self._torch_sched = None
+        if optimizer is not None:
+            # LambdaLR scales the initial lr of each group, so the lambdas
+            # divide it out again to yield the absolute scheduled lr
+            for param_group in optimizer.param_groups:
+                param_group.setdefault("initial_lr", param_group["lr"])
+            self._torch_sched = torch.optim.lr_scheduler.LambdaLR(
+                optimizer,
+                lr_lambda=[
+                    partial(self._lr_factor, initial_lr=param_group["initial_lr"])
+                    for param_group in optimizer.param_groups
+                ],
+            )
+
+    def calc_lr(self, epoch: Union[float, np.ndarray]):
+        if np.ndim(epoch) == 0 and float(epoch).is_integer():
+            return self._lr_table[int(epoch)]
+        if self._lr_at is not None:
+            return self._lr_at(epoch)
+        return np.power(
+            10, np.interp(epoch, self._epoch_grid, np.log10(self._lr_table))
+        )
 
     def get_lr(self, epoch: int):
+        if (
+            np.ndim(epoch) == 0
+            and float(epoch).is_integer()
+            and 0 <= epoch < len(self._epoch_lr_table)
+        ):
+            return self._epoch_lr_table[int(epoch)]
         epoch = epoch % self.total_epochs
         if (type(epoch) is int and epoch > self.total_epochs) or (
             type(epoch) is np.ndarray and np.max(epoch) > self.total_epochs
@@ -82,16 +177,55 @@ class LearningRateScheduler:
             raise AssertionError("Requested epoch out of precalculated schedule")
         return self.calc_lr(epoch)
 
+    def _lr_factor(self, epoch: int, initial_lr: float):
+        return self.get_lr(epoch) / initial_lr
+
     def adjust_learning_rate(self, optimizer: torch.optim.Optimizer, epoch: int):
+        if self._torch_sched is not None and optimizer is self._torch_sched.optimizer:
+            with catch_warnings():
+                # the schedule is indexed by epoch and set before the first
+                # optimizer step
+                filterwarnings(
+                    "ignore", message="The epoch parameter in `scheduler.step"
+                )
+                filterwarnings("ignore", message="Detected call of `lr_scheduler.step")
+                self._torch_sched.step(epoch)
+            return self._torch_sched.get_last_lr()[0]
         new_lr = self.get_lr(epoch)
         for param_group in optimizer.param_groups:
             param_group["lr"] = new_lr
         return new_lr
 
 
+def config_members(args) -> List[str]:
+    """Sorted attribute names of an Arguments or argparse Namespace object."""
+    return sorted(vars(args))
+
+
+_REQUIRED = object()
+
+
+def _read_option(values: dict, section: str, option: str, cast=str, fallback=_REQUIRED):
+    value = values.get(section, {}).get(option)
+    if value is None:
+        if fallback is _REQUIRED:
+            raise NoOptionError(option, section)
+        return fallback
+    if cast is bool:
+        if value.lower() not in ConfigParser.BOOLEAN_STATES:
+            raise ValueError("Not a boolean: {:s}".format(value))
+        return ConfigParser.BOOLEAN_STATES[value.lower()]
+    return cast(value)
+
+
 class Arguments:
     def __init__(self, cmd_args, config, mode: str = "train", verbose: bool = True):
         assert mode in ["train", "inference"], "no other mode known"
+        # read every section once instead of one lookup per option
+        read = partial(
+            _read_option,
+            {section: dict(config.items(section)) for section in config.sections()},
+        )
         self.name = (
             cmd_args.training_name
             if hasattr(cmd_args, "training_name") and cmd_args.training_name
@@ -102,15 +236,13 @@ class Arguments:
             if hasattr(cmd_args, "save_file")
             else "model_weights/completed_trainings.csv"
         )
-        self.batch_size = config.getint("config", "batch_size")  # , fallback=1)
-        self.test_batch_size = config.getint(
-            "config", "test_batch_size"
-        )  # , fallback=1)
-        self.train_resolution = config.getint(
-            "config", "train_resolution"
+        self.batch_size = read("config", "batch_size", int)  # , fallback=1)
+        self.test_batch_size = read("config", "test_batch_size", int)  # , fallback=1)
+        self.train_resolution = read(
+            "config", "train_resolution", int
         )  # , fallback=224
-        self.inference_resolution = config.getint(
-            "config", "inference_resolution", fallback=self.train_resolution
+        self.inference_resolution = read(
+            "config", "inference_resolution", int, fallback=self.train_resolution
         )
         if self.train_resolution != self.inference_resolution:
             warn(
@@ -118,95 +250,82 @@ class Arguments:
                 " resolutions although it works for some scenarios.",
                 category=UserWarning,
             )
-        self.validation_split = config.getint(
-            "config", "validation_split"
+        self.validation_split = read(
+            "config", "validation_split", int
         )  # , fallback=10)
-        self.epochs = config.getint("config", "epochs")  # , fallback=1)
-        self.lr = config.getfloat("config", "lr")  # , fallback=1e-3)
-        self.end_lr = config.getfloat("config", "end_lr", fallback=self.lr)
-        self.deterministic = config.getboolean("config", "deterministic")
-        self.restarts = config.getint("config", "restarts")  # , fallback=None)
-        self.seed = config.getint("config", "seed", fallback=1)
-        self.test_interval = config.getint("config", "test_interval", fallback=1)
-        self.log_interval = config.getint("config", "log_interval", fallback=10)
-        # self.save_interval = config.getint("config", "save_interval", fallback=10)
-        # self.save_model = config.getboolean("config", "save_model", fallback=False)
-        self.optimizer = config.get("config", "optimizer")  # , fallback="SGD")
-        self.differentially_private = config.getboolean(
-            "config", "differentially_private", fallback=False
+        self.epochs = read("config", "epochs", int)  # , fallback=1)
+        self.lr = read("config", "lr", float)  # , fallback=1e-3)
+        self.end_lr = read("config", "end_lr", float, fallback=self.lr)
+        self.deterministic = read("config", "deterministic", bool)
+        self.restarts = read("config", "restarts", int)  # , fallback=None)
+        self.lr_schedule = read("config", "lr_schedule", str, fallback="log_linear")
+        self.warmup_epochs = read("config", "warmup_epochs", int, fallback=0)
+        self.restart_mult = read("config", "restart_mult", int, fallback=1)
+        self.seed = read("config", "seed", int, fallback=1)
+        self.test_interval = read("config", "test_interval", int, fallback=1)
+        self.log_interval = read("config", "log_interval", int, fallback=10)
+        # self.save_interval = read("config", "save_interval", int, fallback=10)
+        # self.save_model = read("config", "save_model", bool, fallback=False)
+        self.optimizer = read("config", "optimizer", str)  # , fallback="SGD")
+        self.differentially_private = read(
+            "config", "differentially_private", bool, fallback=False
         )
         assert self.optimizer in ["SGD", "Adam"], "Unknown optimizer"
         if self.optimizer == "Adam":
-            self.beta1 = config.getfloat("config", "beta1", fallback=0.9)
-            self.beta2 = config.getfloat("config", "beta2", fallback=0.999)
-        self.model = config.get("config", "model")  # , fallback="simpleconv")
+            self.beta1 = read("config", "beta1", float, fallback=0.9)
+            self.beta2 = read("config", "beta2", float, fallback=0.999)
+        self.model = read("config", "model", str)  # , fallback="simpleconv")
         assert self.model in ["simpleconv", "resnet-18", "vgg16"]
-        self.pooling_type = config.get("config", "pooling_type", fallback="max")
-        self.pretrained = config.getboolean("config", "pretrained")  # , fallback=False)
-        self.weight_decay = config.getfloat("config", "weight_decay")  # , fallback=0.0)
-        self.weight_classes = config.getboolean(
-            "config", "weight_classes"
+        self.pooling_type = read("config", "pooling_type", str, fallback="max")
+        self.pretrained = read("config", "pretrained", bool)  # , fallback=False)
+        self.weight_decay = read("config", "weight_decay", float)  # , fallback=0.0)
+        self.weight_classes = read(
+            "config", "weight_classes", bool
         )  # , fallback=False)
-        self.rotation = config.getfloat("augmentation", "rotation")  # , fallback=0.0)
-        self.translate = config.getfloat("augmentation", "translate")  # , fallback=0.0)
-        self.scale = config.getfloat("augmentation", "scale")  # , fallback=0.0)
-        self.shear = config.getfloat("augmentation", "shear")  # , fallback=0.0)
-        self.albu_prob = config.getfloat(
-            "albumentations", "overall_prob"
+        self.rotation = read("augmentation", "rotation", float)  # , fallback=0.0)
+        self.translate = read("augmentation", "translate", float)  # , fallback=0.0)
+        self.scale = read("augmentation", "scale", float)  # , fallback=0.0)
+        self.shear = read("augmentation", "shear", float)  # , fallback=0.0)
+        self.albu_prob = read(
+            "albumentations", "overall_prob", float
         )  # , fallback=1.0)
-        self.individual_albu_probs = config.getfloat(
-            "albumentations", "individual_probs"
+        self.individual_albu_probs = read(
+            "albumentations", "individual_probs", float
         )  # , fallback=1.0)
-        self.noise_std = config.getfloat(
-            "albumentations", "noise_std"
-        )  # , fallback=1.0)
-        self.noise_prob = config.getfloat(
-            "albumentations", "noise_prob"
-        )  # , fallback=0.0)
-        self.clahe = config.getboolean("albumentations", "clahe")  # , fallback=False)
-        self.randomgamma = config.getboolean(
-            "albumentations", "randomgamma"
+        self.noise_std = read("albumentations", "noise_std", float)  # , fallback=1.0)
+        self.noise_prob = read("albumentations", "noise_prob", float)  # , fallback=0.0)
+        self.clahe = read("albumentations", "clahe", bool)  # , fallback=False)
+        self.randomgamma = read(
+            "albumentations", "randomgamma", bool
         )  # , fallback=False
-        self.randombrightness = config.getboolean(
-            "albumentations", "randombrightness"
+        self.randombrightness = read(
+            "albumentations", "randombrightness", bool
         )  # , fallback=False
-        self.blur = config.getboolean("albumentations", "blur")  # , fallback=False)
-        self.elastic = config.getboolean(
-            "albumentations", "elastic"
-        )  # , fallback=False)
-        self.optical_distortion = config.getboolean(
-            "albumentations", "optical_distortion"
+        self.blur = read("albumentations", "blur", bool)  # , fallback=False)
+        self.elastic = read("albumentations", "elastic", bool)  # , fallback=False)
+        self.optical_distortion = read(
+            "albumentations", "optical_distortion", bool
         )  # , fallback=False
-        self.grid_distortion = config.getboolean(
-            "albumentations", "grid_distortion"
+        self.grid_distortion = read(
+            "albumentations", "grid_distortion", bool
         )  # , fallback=False)
-        self.grid_shuffle = config.getboolean(
-            "albumentations", "grid_shuffle"
+        self.grid_shuffle = read(
+            "albumentations", "grid_shuffle", bool
         )  # , fallback=False
-        self.hsv = config.getboolean("albumentations", "hsv")  # , fallback=False)
-        self.invert = config.getboolean("albumentations", "invert")  # , fallback=False)
-        self.cutout = config.getboolean("albumentations", "cutout")  # , fallback=False)
-        self.shadow = config.getboolean("albumentations", "shadow")  # , fallback=False)
-        self.fog = config.getboolean("albumentations", "fog")  # , fallback=False)
-        self.sun_flare = config.getboolean(
-            "albumentations", "sun_flare"
+        self.hsv = read("albumentations", "hsv", bool)  # , fallback=False)
+        self.invert = read("albumentations", "invert", bool)  # , fallback=False)
+        self.cutout = read("albumentations", "cutout", bool)  # , fallback=False)
+        self.shadow = read("albumentations", "shadow", bool)  # , fallback=False)
+        self.fog = read("albumentations", "fog", bool)  # , fallback=False)
+        self.sun_flare = read("albumentations", "sun_flare", bool)  # , fallback=False
+        self.solarize = read("albumentations", "solarize", bool)  # , fallback=False)
+        self.equalize = read("albumentations", "equalize", bool)  # , fallback=False)
+        self.grid_dropout = read(
+            "albumentations", "grid_dropout", bool
         )  # , fallback=False
-        self.solarize = config.getboolean(
-            "albumentations", "solarize"
-        )  # , fallback=False)
-        self.equalize = config.getboolean(
-            "albumentations", "equalize"
-        )  # , fallback=False)
-        self.grid_dropout = config.getboolean(
-            "albumentations", "grid_dropout"
-        )  # , fallback=False
-        self.mixup = config.getboolean("augmentation", "mixup")  # , fallback=False)
-        self.mixup_prob = config.getfloat(
-            "augmentation", "mixup_prob"
-        )  # , fallback=None)
-        self.mixup_lambda = config.getfloat(
-            "augmentation", "mixup_lambda", fallback=None
-        )
+        self.mixup = read("augmentation", "mixup", bool)  # , fallback=False)
+        self.mixup_prob = read("augmentation", "mixup_prob", float)  # , fallback=None)
+        self.mixup_lambda = read("augmentation", "mixup_lambda", float, fallback=None)
         if self.mixup and self.mixup_prob == 1.0:
             self.batch_size *= 2
             print("Doubled batch size because of mixup")
@@ -215,17 +334,15 @@ class Arguments:
             cmd_args.unencrypted_aggregation if mode == "train" else False
         )
         if self.train_federated:
-            self.sync_every_n_batch = config.getint(
-                "federated", "sync_every_n_batch"
+            self.sync_every_n_batch = read(
+                "federated", "sync_every_n_batch", int
             )  # , fallback=10
-            self.wait_interval = config.getfloat(
-                "federated", "wait_interval", fallback=0.1
-            )
-            self.keep_optim_dict = config.getboolean(
-                "federated", "keep_optim_dict"
+            self.wait_interval = read("federated", "wait_interval", float, fallback=0.1)
+            self.keep_optim_dict = read(
+                "federated", "keep_optim_dict", bool
             )  # , fallback=False
-            self.repetitions_dataset = config.getint(
-                "federated", "repetitions_dataset"
+            self.repetitions_dataset = read(
+                "federated", "repetitions_dataset", int
             )  # , fallback=1
             if self.repetitions_dataset > 1:
                 self.epochs = int(self.epochs / self.repetitions_dataset)
@@ -236,11 +353,11 @@ class Arguments:
                             self.epochs, self.repetitions_dataset
                         )
                     )
-            self.weighted_averaging = config.getboolean(
-                "federated", "weighted_averaging"
+            self.weighted_averaging = read(
+                "federated", "weighted_averaging", bool
             )  # , fallback=False
-            self.precision_fractional = config.getfloat(
-                "federated", "precision_fractional", fallback=16
+            self.precision_fractional = read(
+                "federated", "precision_fractional", float, fallback=16
             )
         self.visdom = cmd_args.visdom if mode == "train" else False
         self.encrypted_inference = (
@@ -251,19 +368,14 @@ class Arguments:
         self.websockets = cmd_args.websockets if mode == "train" else False
         if self.websockets:
             assert self.train_federated, "If you use websockets it must be federated"
-        self.num_threads = config.getint("system", "num_threads", fallback=0)
+        self.num_threads = read("system", "num_threads", int, fallback=0)
 
     @classmethod
     def from_namespace(cls, args):
         obj = cls.__new__(cls)
         super(Arguments, obj).__init__()
-        for attr in dir(args):
-            if (
-                not callable(getattr(args, attr))
-                and not attr.startswith("__")
-                and attr in dir(args)
-            ):
-                setattr(obj, attr, getattr(args, attr))
+        for attr, value in vars(args).items():
+            setattr(obj, attr, value)
         return obj
 
     def from_previous_checkpoint(self, cmd_args):
@@ -276,30 +388,20 @@ class Arguments:
             if self.encrypted_inference and hasattr(cmd_args, "websockets")
             else False
         )
-        if not "mixup" in dir(self):
+        if not hasattr(self, "mixup"):
             self.mixup = False
 
     def incorporate_cmd_args(self, cmd_args):
         exceptions = []  # just for future
-        for attr in dir(self):
-            if (
-                not callable(getattr(self, attr))
-                and not attr.startswith("__")
-                and attr in dir(cmd_args)
-                and attr not in exceptions
-            ):
-                setattr(self, attr, getattr(cmd_args, attr))
+        cmd_members = vars(cmd_args)
+        for attr in config_members(self):
+            if attr in cmd_members and attr not in exceptions:
+                setattr(self, attr, cmd_members[attr])
 
     def __str__(self):
-        members = [
-            attr
-            for attr in dir(self)
-            if not callable(getattr(self, attr)) and not attr.startswith("__")
-        ]
-        rows = []
-        for x in members:
-            rows.append([str(x), str(getattr(self, x))])
-        return tabulate(rows)
+        return tabulate(
+            [[str(attr), str(getattr(self, attr))] for attr in config_members(self)]
+        )
 
 
 class AddGaussianNoise(torch.nn.Module):
@@ -312,10 +414,9 @@ class AddGaussianNoise(torch.nn.Module):
     def forward(self, tensor: torch.Tensor):
         if self.p and self.p < random():
             return tensor
-        return (
-            tensor
-            + torch.randn(tensor.size()) * self.std  # pylint: disable=no-member
-            + self.mean
+        # sample on the device and with the dtype of the input
+        return tensor + torch.empty_like(tensor).normal_(  # pylint: disable=no-member
+            mean=self.mean, std=self.std
         )
 
     def __repr__(self):
@@ -372,31 +473,24 @@ class MixUp(torch.nn.Module):
             λ = self.λ
         else:
             λ = random()
+        if not torch.is_tensor(x):
+            x = torch.stack(x).squeeze(1)  # pylint:disable=no-member
+        if not torch.is_tensor(y):
+            y = torch.stack(y).squeeze(1)  # pylint:disable=no-member
+        # λ * a + (1 - λ) * b == lerp(b, a, λ)
+        h = L // 2
         if L % 2 == 0:
-            h = L // 2
-            if not torch.is_tensor(x):
-                x = torch.stack(x).squeeze(1)  # pylint:disable=no-member
-            if not torch.is_tensor(y):
-                y = torch.stack(y).squeeze(1)  # pylint:disable=no-member
-            x = λ * x[:h] + (1.0 - λ) * x[h:]
-            y = λ * y[:h] + (1.0 - λ) * y[h:]
+            x = torch.lerp(x[h:], x[:h], λ)  # pylint:disable=no-member
+            y = torch.lerp(y[h:], y[:h], λ)  # pylint:disable=no-member
             return x, y
         else:
-            # Actually there should be another distinction
-            # between tensors and tuples
-            # but in our use case this only happens if tensors
-            # are used
-            h = (L - 1) // 2
-            out_x = torch.zeros(  # pylint:disable=no-member
-                (h + 1, *x.shape[1:]), device=x.device
+            # the last sample has no partner and is passed through unmixed
+            out_x = torch.cat(  # pylint:disable=no-member
+                [torch.lerp(x[h:-1], x[:h], λ), x[-1:]], dim=0
             )
-            out_y = torch.zeros(  # pylint:disable=no-member
-                (h + 1, *y.shape[1:]), device=y.device
+            out_y = torch.cat(  # pylint:disable=no-member
+                [torch.lerp(y[h:-1], y[:h], λ), y[-1:]], dim=0
             )
-            out_x[-1] = x[-1]
-            out_y[-1] = y[-1]
-            out_x[:-1] = λ * x[:h] + (1.0 - λ) * x[h:-1]
-            out_y[:-1] = λ * y[:h] + (1.0 - λ) * y[h:-1]
             return out_x, out_y
 
 
@@ -411,31 +505,17 @@ class Cross_entropy_one_hot(torch.nn.Module):
             else None
         )
         self.reduction = reduction
-        self.logsoftmax = torch.nn.LogSoftmax(dim=1)
 
     def forward(self, output: torch.Tensor, target: torch.Tensor):
+        loss = -torch.einsum(  # pylint:disable=no-member
+            "bc,bc->b", target, F.log_softmax(output, dim=1)
+        )
+        if self.weight is not None:
+            loss = loss * torch.matmul(target, self.weight)  # pylint:disable=no-member
         if self.reduction == "mean":
-            loss = torch.mean(  # pylint:disable=no-member
-                (
-                    torch.sum(self.weight * target, dim=1)  # pylint:disable=no-member
-                    if self.weight is not None
-                    else 1.0
-                )
-                * torch.sum(  # pylint:disable=no-member
-                    -target * self.logsoftmax(output), dim=1
-                )
-            )
+            loss = loss.mean()
         elif self.reduction == "sum":
-            loss = torch.sum(  # pylint:disable=no-member
-                (
-                    torch.sum(self.weight * target, dim=1)  # pylint:disable=no-member
-                    if self.weight is not None
-                    else 1.0
-                )
-                * torch.sum(  # pylint:disable=no-member
-                    -target * self.logsoftmax(output), dim=1
-                )
-            )
+            loss = loss.sum()
         else:
             raise NotImplementedError("reduction method unknown")
         return loss
@@ -447,23 +527,13 @@ class To_one_hot(torch.nn.Module):
         self.num_classes = num_classes
 
     def forward(self, x: Union[int, List[int], torch.Tensor]):
-        if type(x) == int:
+        if not torch.is_tensor(x):
             x = torch.tensor(x)  # pylint:disable=not-callable
-        elif type(x) == list:
-            x = torch.tensor(x)  # pylint:disable=not-callable
-        if len(x.shape) == 0:
-            one_hot = torch.zeros(  # pylint:disable=no-member
-                (self.num_classes,), device=x.device
-            )
-            one_hot.scatter_(0, x, 1)
-            return one_hot
-        elif len(x.shape) == 1:
-            x = x.unsqueeze(1)
-        one_hot = torch.zeros(  # pylint:disable=no-member
-            (x.shape[0], self.num_classes), device=x.device
-        )
-        one_hot.scatter_(1, x, 1)
-        return one_hot
+        one_hot = F.one_hot(x.long(), num_classes=self.num_classes)
+        if x.dim() == 2:
+            # (B, k) indices are scattered into one (B, num_classes) row each
+            one_hot = one_hot.max(dim=1)[0]
+        return one_hot.float()
 
 
 def calc_class_weights(args, train_loader, num_classes):
@@ -857,21 +927,27 @@ def setup_pysyft(args, hook, verbose=False):
 
 
 def save_config_results(args, score: float, timestamp: str, table: str):
-    members = [
-        attr
-        for attr in dir(args)
-        if not callable(getattr(args, attr)) and not attr.startswith("__")
-    ]
+    members = config_members(args)
+    new_row = dict(zip(members, [getattr(args, x) for x in members]))
+    new_row["timestamp"] = timestamp
+    new_row["best_validation_score"] = score
     if not isfile(table):
         print("Configuration table does not exist - Creating new")
-        df = pd.DataFrame(columns=members)
+        fieldnames = None
     else:
+        with open(table, "r", newline="") as f:
+            fieldnames = next(reader(f), None)
+    if fieldnames and not set(new_row).issubset(fieldnames):
+        # new configuration values: the header has to be extended
         df = pd.read_csv(table)
-    new_row = dict(zip(members, [getattr(args, x) for x in members]))
-    new_row["timestamp"] = timestamp
-    new_row["best_validation_score"] = score
-    df = df.append(new_row, ignore_index=True)
-    df.to_csv(table, index=False)
+        df = df.append(new_row, ignore_index=True)
+        df.to_csv(table, index=False)
+        return
+    with open(table, "a", newline="") as f:
+        writer = DictWriter(f, fieldnames=fieldnames or list(new_row.keys()))
+        if not fieldnames:
+            writer.writeheader()
+        writer.writerow(new_row)
 
 
 ## Adaption of federated averaging from syft with option of weights
@@ -883,21 +959,36 @@ def federated_avg(models: dict, weights=None):
     Args:
         models (Dict[Any, torch.nn.Module]): a dictionary of models
         for which the federated average is calculated.
+        weights (Dict[Any, float], optional): weight of each model,
+        uniform weights are used if not given.
 
     Returns:
-        torch.nn.Module: the module with averaged parameters.
+        torch.nn.Module: the first model, holding the averaged state.
+
+    Note:
+        The training loop does not call this function, it averages the
+        worker models through aggregation().
     """
+    model_list = list(models.values())
     if weights:
-        model = None
-        for idt, partial_model in models.items():
-            scaled_model = scale_model(partial_model, weights[idt])
-            if model:
-                model = add_model(model, scaled_model)
-            else:
-                model = scaled_model
+        scales = [weights[idt] for idt in models.keys()]
     else:
-        model = syft_fl_utils.federated_avg(models)
-    return model
+        scales = [1.0 / len(model_list)] * len(model_list)
+    state_dicts = [m.state_dict() for m in model_list]
+    fresh_state_dict = dict()
+    for key, value in state_dicts[0].items():
+        if not value.is_floating_point():  # e.g. num_batches_tracked
+            fresh_state_dict[key] = value
+            continue
+        # weighted sum over the model axis of the stacked tensors
+        stacked = torch.stack(  # pylint:disable=no-member
+            [sd[key] for sd in state_dicts]
+        )
+        fresh_state_dict[key] = torch.tensordot(  # pylint:disable=no-member
+            stacked.new_tensor(scales), stacked, dims=1
+        )
+    model_list[0].load_state_dict(fresh_state_dict)
+    return model_list[0]
 
 
 def training_animation(done: mp.Value, message: str = "training"):
@@ -1093,15 +1184,16 @@ def aggregation(
 
 
 def send_new_models(local_model, models):  # original version
+    if local_model.location is not None:  # local model is at worker
+        local_model.get()
     for worker in models.keys():
         if worker == "local_model":
             continue
-        if local_model.location is not None:  # local model is at worker
-            local_model.get()
-        local_model.send(worker)
-        models[worker].load_state_dict(local_model.state_dict())
-    if local_model.location is not None:
-        local_model.get()
+        # send a copy so the local model does not have to be fetched back
+        # from every worker before it can be sent to the next one
+        remote_model = local_model.copy().send(worker)
+        models[worker].load_state_dict(remote_model.state_dict())
+        del remote_model
     return models  # returns models updated on workers
 
 
@@ -1130,7 +1222,11 @@ def secure_aggregation_epoch(
 
     if not args.keep_optim_dict:
         for worker in optimizers.keys():
-            kwargs = {"lr": args.lr, "weight_decay": args.weight_decay}
+            # keep the learning rate set by the scheduler for this epoch
+            kwargs = {
+                "lr": optimizers[worker].param_groups[0]["lr"],
+                "weight_decay": args.weight_decay,
+            }
             if args.optimizer == "Adam":
                 kwargs["betas"] = (args.beta1, args.beta2)
                 opt = torch.optim.Adam
@@ -1207,7 +1303,10 @@ def secure_aggregation_epoch(
                 pass
             else:
                 for worker in optimizers.keys():
-                    kwargs = {"lr": args.lr, "weight_decay": args.weight_decay}
+                    kwargs = {
+                        "lr": optimizers[worker].param_groups[0]["lr"],
+                        "weight_decay": args.weight_decay,
+                    }
                     if args.optimizer == "Adam":
                         kwargs["betas"] = (args.beta1, args.beta2)
                         opt = torch.optim.Adam
@@ -1248,8 +1347,6 @@ def train(  # never called on websockets
     model.train()
     if args.mixup:
         mixup = MixUp(λ=args.mixup_lambda, p=args.mixup_prob)
-        oh_converter = To_one_hot(num_classes)
-        oh_converter.to(device)
 
     L = len(train_loader)
     div = 1.0 / float(L)
@@ -1260,10 +1357,12 @@ def train(  # never called on websockets
         desc="training epoch {:d}".format(epoch),
         total=L + 1,
     ):
-        data, target = data.to(device), target.to(device)
+        # overlaps the copy with compute if the loader uses pinned memory
+        data = data.to(device, non_blocking=True)
+        target = target.to(device, non_blocking=True)
         if args.mixup:
             with torch.no_grad():
-                target = oh_converter(target)
+                target = F.one_hot(target, num_classes).float()
                 data, target = mixup((data, target))
         optimizer.zero_grad()
         output = model(data)
@@ -1292,65 +1391,163 @@ def train(  # never called on websockets
     return model
 
 
-def stats_table(
-    conf_matrix, report, roc_auc=0.0, matthews_coeff=0.0, class_names=None, epoch=0
-):
-    rows = []
+_REPORT_KEYS = ("precision", "recall", "f1-score")
+
+
+def matthews_from_confusion(conf_matrix):
+    """Multiclass Matthews correlation coefficient of a confusion matrix with
+    true labels on the rows, as in ``sklearn.metrics.matthews_corrcoef``."""
+    conf_matrix = np.asarray(conf_matrix, dtype=np.float64)
+    t_sum, p_sum = conf_matrix.sum(axis=1), conf_matrix.sum(axis=0)
+    n_correct, n = np.trace(conf_matrix), conf_matrix.sum()
+    cov_ytyp = n_correct * n - t_sum.dot(p_sum)
+    cov_ypyp = n * n - p_sum.dot(p_sum)
+    cov_ytyt = n * n - t_sum.dot(t_sum)
+    denominator = np.sqrt(cov_ytyt * cov_ypyp)
+    return cov_ytyp / denominator if denominator else 0.0
+
+
+def class_stats(target, pred, num_classes, scores=None, with_report=True):
+    """Confusion matrix, classification report, Matthews correlation coefficient
+    and, if class scores are given, the ROC AUC score.
+
+    All statistics are derived from a single bincount over the predictions. The
+    report has the layout of ``sklearn.metrics.classification_report`` with
+    ``output_dict=True`` and ``zero_division=0``, it is None if ``with_report``
+    is False. The ROC AUC score is computed by sklearn, one-vs-one for more
+    than two classes.
+    """
+    # converted once, the metrics below then work on the arrays without copies
+    target = np.ascontiguousarray(target, dtype=np.int64)
+    pred = np.ascontiguousarray(pred, dtype=np.int64)
+    if scores is not None:
+        scores = np.ascontiguousarray(scores, dtype=np.float32)
+    conf_matrix = np.bincount(
+        num_classes * target + pred, minlength=num_classes * num_classes
+    ).reshape(num_classes, num_classes)
+    tp = np.diag(conf_matrix).astype(np.float64)
+    support = conf_matrix.sum(axis=1)
+    predicted = conf_matrix.sum(axis=0)
+    n = support.sum()
+    matthews_coeff = matthews_from_confusion(conf_matrix)
+    roc_auc = 0.0
+    if scores is not None:
+        try:
+            # sklearn expects the positive class scores for binary targets
+            roc_auc = mt.roc_auc_score(
+                target, scores[:, 1] if num_classes == 2 else scores, multi_class="ovo"
+            )
+        except ValueError:
+            warn(
+                "ROC AUC score could not be calculated and was set to zero.",
+                category=UserWarning,
+            )
+    if not with_report:
+        return conf_matrix, None, matthews_coeff, roc_auc
+    precision = np.divide(tp, predicted, out=np.zeros(num_classes), where=predicted > 0)
+    recall = np.divide(tp, support, out=np.zeros(num_classes), where=support > 0)
+    f1 = np.divide(
+        2.0 * precision * recall,
+        precision + recall,
+        out=np.zeros(num_classes),
+        where=(precision + recall) > 0,
+    )
+    # one (precision, recall, f1-score) row per class, averaged along axis 0
+    metrics = np.stack((precision, recall, f1), axis=1)
+    report = {
+        str(i): dict(zip(_REPORT_KEYS, row), support=int(class_support))
+        for i, (row, class_support) in enumerate(
+            zip(metrics.tolist(), support.tolist())
+        )
+    }
+    report["accuracy"] = tp.sum() / n if n else 0.0
+    # like sklearn, classes which neither occur nor are predicted are not averaged
+    present = (support + predicted) > 0
+    for name, average in (
+        ("macro avg", partial(np.mean, axis=0)),
+        ("weighted avg", partial(np.average, axis=0, weights=support[present])),
+    ):
+        report[name] = dict(
+            zip(_REPORT_KEYS, average(metrics[present]).tolist()), support=int(n)
+        )
+    return conf_matrix, report, matthews_coeff, roc_auc
+
+
+@lru_cache(maxsize=None)
+def _class_headers(class_names, num_classes):
+    # the class columns only change with the class names, not in every epoch
+    return class_names if class_names else tuple(range(num_classes))
+
+
+def _iter_rows(conf_matrix, report, roc_auc, matthews_coeff, class_names):
     for i in range(conf_matrix.shape[0]):
         report_entry = report[str(i)]
-        row = [
-            class_names[i] if class_names else i,
-            "{:.1f} %".format(report_entry["recall"] * 100.0),
-            "{:.1f} %".format(report_entry["precision"] * 100.0),
-            "{:.1f} %".format(report_entry["f1-score"] * 100.0),
+        r, p, f, s = (
+            report_entry["recall"] * 100.0,
+            report_entry["precision"] * 100.0,
+            report_entry["f1-score"] * 100.0,
             report_entry["support"],
-        ]
-        row.extend([conf_matrix[i, j] for j in range(conf_matrix.shape[1])])
-        rows.append(row)
-    rows.append(
-        [
-            "Overall (macro)",
-            "{:.1f} %".format(report["macro avg"]["recall"] * 100.0),
-            "{:.1f} %".format(report["macro avg"]["precision"] * 100.0),
-            "{:.1f} %".format(report["macro avg"]["f1-score"] * 100.0),
-            report["macro avg"]["support"],
-        ]
+        )
+        yield (
+            class_names[i] if class_names else i,
+            f"{r:.1f} %",
+            f"{p:.1f} %",
+            f"{f:.1f} %",
+            s,
+            *conf_matrix[i].tolist(),
+        )
+    macro, weighted = report["macro avg"], report["weighted avg"]
+    yield (
+        "Overall (macro)",
+        f"{macro['recall'] * 100.0:.1f} %",
+        f"{macro['precision'] * 100.0:.1f} %",
+        f"{macro['f1-score'] * 100.0:.1f} %",
+        macro["support"],
     )
-    rows.append(
-        [
-            "Overall (weighted)",
-            "{:.1f} %".format(report["weighted avg"]["recall"] * 100.0),
-            "{:.1f} %".format(report["weighted avg"]["precision"] * 100.0),
-            "{:.1f} %".format(report["weighted avg"]["f1-score"] * 100.0),
-            report["weighted avg"]["support"],
-        ]
+    yield (
+        "Overall (weighted)",
+        f"{weighted['recall'] * 100.0:.1f} %",
+        f"{weighted['precision'] * 100.0:.1f} %",
+        f"{weighted['f1-score'] * 100.0:.1f} %",
+        weighted["support"],
     )
-    rows.append(["Overall stats", "micro recall", "matthews coeff", "AUC ROC score"])
-    rows.append(
-        [
-            "",
-            "{:.1f} %".format(100.0 * report["accuracy"]),
-            "{:.3f}".format(matthews_coeff),
-            "{:.3f}".format(roc_auc),
-        ]
+    yield ("Overall stats", "micro recall", "matthews coeff", "AUC ROC score")
+    yield (
+        "",
+        f"{100.0 * report['accuracy']:.1f} %",
+        f"{matthews_coeff:.3f}",
+        f"{roc_auc:.3f}",
     )
-    headers = [
-        "Epoch {:d}".format(epoch),
+
+
+def stats_table(
+    conf_matrix, report, roc_auc=0.0, matthews_coeff=0.0, class_names=None, epoch=0
+):
+    headers = (
+        f"Epoch {epoch:d}",
         "Recall",
         "Precision",
         "F1 score",
         "n total",
-    ]
-    headers.extend(
-        [class_names[i] if class_names else i for i in range(conf_matrix.shape[0])]
+    ) + _class_headers(
+        # indexed like the rows, class_names may be a list or a dict
+        tuple(class_names[i] for i in range(conf_matrix.shape[0]))
+        if class_names
+        else None,
+        conf_matrix.shape[0],
     )
     return tabulate(
-        rows,
+        _iter_rows(conf_matrix, report, roc_auc, matthews_coeff, class_names),
         headers=headers,
         tablefmt="fancy_grid",
     )
 
 
+# one element buffers for the per-epoch visdom lines of test()
+_vis_epoch = np.empty(1, dtype=np.int64)
+_vis_value = np.empty(1, dtype=np.float64)
+
+
 def test(
     args,
     model,
@@ -1363,13 +1560,24 @@ def test(
     vis_params=None,
     class_names=None,
 ):
-    oh_converter = None
-    if args.mixup or (args.train_federated and args.weight_classes):
-        oh_converter = To_one_hot(num_classes)
-        oh_converter.to(device)
+    one_hot_targets = args.mixup or (args.train_federated and args.weight_classes)
     model.eval()
     test_loss, TP = 0, 0
-    total_pred, total_target, total_scores = [], [], []
+    if not args.encrypted_inference:
+        # results stay on the device and are transferred once after the loop
+        L = len(val_loader.dataset)
+        test_loss = torch.zeros((), device=device)  # pylint: disable=no-member
+        # the scores are only needed for the ROC AUC of the verbose stats table
+        total_scores = (
+            torch.empty((L, num_classes), device=device)  # pylint: disable=no-member
+            if verbose
+            else None
+        )
+        total_pred = torch.empty(  # pylint: disable=no-member
+            L, dtype=torch.long, device=device  # pylint: disable=no-member
+        )
+        total_target = torch.empty_like(total_pred)  # pylint: disable=no-member
+        n_seen = 0
     with torch.no_grad():
         for data, target in (
             tqdm.tqdm(
@@ -1381,21 +1589,32 @@ def test(
             if verbose
             else val_loader
         ):
-            data, target = data.to(device), target.to(device)
+            data = data.to(device, non_blocking=True)
+            target = target.to(device, non_blocking=True)
             output = model(data)
-            loss = loss_fn(output, oh_converter(target) if oh_converter else target)
-            test_loss += loss.item()  # sum up batch loss
-            total_scores.append(output)
+            loss = loss_fn(
+                output,
+                F.one_hot(target, num_classes).float() if one_hot_targets else target,
+            )
             pred = output.argmax(dim=1)
             tgts = target.view_as(pred)
-            total_pred.append(pred)
-            total_target.append(tgts)
-            equal = pred.eq(tgts)
-            TP += (
-                equal.sum().copy().get().float_precision().long().item()
-                if args.encrypted_inference
-                else equal.sum().item()
-            )
+            if args.encrypted_inference:
+                test_loss += loss.item()  # sum up batch loss
+                TP += pred.eq(tgts).sum().copy().get().float_precision().long().item()
+            else:
+                test_loss += loss.detach()  # sum up batch loss
+                n = pred.shape[0]
+                if verbose:
+                    total_scores[n_seen : n_seen + n] = output
+                total_pred[n_seen : n_seen + n] = pred
+                total_target[n_seen : n_seen + n] = tgts
+                n_seen += n
+    if not args.encrypted_inference:
+        test_loss = test_loss.item()
+        if verbose:
+            total_scores = total_scores[:n_seen]
+        total_pred = total_pred[:n_seen]
+        total_target = total_target[:n_seen]
     test_loss /= len(val_loader)
     if args.encrypted_inference:
         objective = 100.0 * TP / (len(val_loader) * args.test_batch_size)
@@ -1412,30 +1631,21 @@ def test(
                 # end="",
             )
     else:
-        total_pred = torch.cat(total_pred).cpu().numpy()  # pylint: disable=no-member
-        total_target = (
-            torch.cat(total_target).cpu().numpy()  # pylint: disable=no-member
-        )
-        total_scores = (
-            torch.cat(total_scores).cpu().numpy()  # pylint: disable=no-member
+        total_pred = total_pred.cpu().numpy()
+        total_target = total_target.cpu().numpy()
+        if verbose:
+            total_scores -= total_scores.min(dim=1, keepdim=True)[0]
+            total_scores /= total_scores.sum(dim=1, keepdim=True)
+            total_scores = total_scores.cpu().numpy()
+        conf_matrix, report, matthews_coeff, roc_auc = class_stats(
+            total_target,
+            total_pred,
+            num_classes,
+            scores=total_scores,
+            with_report=verbose,
         )
-        total_scores -= total_scores.min(axis=1)[:, np.newaxis]
-        total_scores = total_scores / total_scores.sum(axis=1)[:, np.newaxis]
-        try:
-            roc_auc = mt.roc_auc_score(total_target, total_scores, multi_class="ovo")
-        except ValueError:
-            warn(
-                "ROC AUC score could not be calculated and was set to zero.",
-                category=UserWarning,
-            )
-            roc_auc = 0.0
-        matthews_coeff = mt.matthews_corrcoef(total_target, total_pred)
         objective = 100.0 * matthews_coeff
         if verbose:
-            conf_matrix = mt.confusion_matrix(total_target, total_pred)
-            report = mt.classification_report(
-                total_target, total_pred, output_dict=True, zero_division=0
-            )
             print(
                 stats_table(
                     conf_matrix,
@@ -1447,17 +1657,21 @@ def test(
                 )
             )
         if args.visdom and vis_params:
+            # visdom serialises the buffers right away, so they can be reused
+            _vis_epoch[0] = epoch
+            _vis_value[0] = test_loss
             vis_params["vis"].line(
-                X=np.asarray([epoch]),
-                Y=np.asarray([test_loss]),
+                X=_vis_epoch,
+                Y=_vis_value,
                 win="loss_win",
                 name="val_loss",
                 update="append",
                 env=vis_params["vis_env"],
             )
+            _vis_value[0] = objective / 100.0
             vis_params["vis"].line(
-                X=np.asarray([epoch]),
-                Y=np.asarray([objective / 100.0]),
+                X=_vis_epoch,
+                Y=_vis_value,
                 win="loss_win",
                 name="matthews coeff",
                 update="append",
@@ -1467,27 +1681,107 @@ def test(
     return test_loss, objective
 
 
+def _copy_to_cpu(value, buffers, path=()):
+    if torch.is_tensor(value):
+        if value.is_cuda and buffers is not None:
+            buffer = buffers.get(path)
+            if (
+                buffer is None
+                or buffer.shape != value.shape
+                or buffer.dtype != value.dtype
+            ):
+                buffer = torch.empty(  # pylint: disable=no-member
+                    value.shape, dtype=value.dtype, pin_memory=True
+                )
+                buffers[path] = buffer
+            return buffer.copy_(value.detach(), non_blocking=True)
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        cpu_value = type(value)()
+        for key, item in value.items():
+            cpu_value[key] = _copy_to_cpu(item, buffers, path + (key,))
+        if hasattr(value, "_metadata"):
+            cpu_value._metadata = value._metadata  # pylint: disable=protected-access
+        return cpu_value
+    if isinstance(value, (list, tuple)):
+        return type(value)(
+            _copy_to_cpu(item, buffers, path + (i,)) for i, item in enumerate(value)
+        )
+    return value
+
+
+def state_dict_to_cpu(state_dict, pinned_buffers: Optional[dict] = None):
+    """Copy a model or optimizer state_dict to CPU memory.
+
+    Nested dicts, lists and tuples are copied recursively. If a dict is given
+    as pinned_buffers, CUDA tensors are copied asynchronously into the pinned
+    host buffers it holds, keyed by their position in the state_dict, and
+    awaited with a single synchronize. Missing buffers are allocated and
+    stored on the way, so the next call on the same dict overwrites them.
+    """
+    cpu_state = _copy_to_cpu(state_dict, pinned_buffers)
+    if pinned_buffers is not None and torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return cpu_state
+
+
+# pinned host buffers of save_model, reused across checkpoints
+_pinned_buffers = {}
+
+
+# checkpoints are written by a single background thread, at most one at a time
+_save_executor = ThreadPoolExecutor(max_workers=1)
+_pending_saves = []
+
+
+def wait_for_saves():
+    """Block until the checkpoint queued by save_model is written and re-raise
+    any error of the write."""
+    while _pending_saves:
+        _pending_saves.pop(0).result()
+
+
+atexit.register(wait_for_saves)
+
+
 def save_model(model, optim, path, args, epoch, val_mean_std):
+    # bounds the queue to one checkpoint and raises a failed previous write
+    # before the next epoch is saved, afterwards the pinned buffers are free
+    wait_for_saves()
+    # snapshot every state on the CPU, the next optimizer steps update the live
+    # states in place while the checkpoint is still queued
     if args.train_federated:
-        opt_state_dict = {key: optim.state_dict() for key, optim in optim.items()}
+        opt_state_dict = {
+            key: state_dict_to_cpu(
+                optim.state_dict(), _pinned_buffers.setdefault(("optim", key), {})
+            )
+            for key, optim in optim.items()
+        }
     # elif args.train_federated:
     #     opt_state_dict = {
     #         name: optim.get_optim(name).state_dict() for name in optim.workers
     #     }
     else:
-        opt_state_dict = optim.state_dict()
+        opt_state_dict = state_dict_to_cpu(
+            optim.state_dict(), _pinned_buffers.setdefault("optim", {})
+        )
     dirpath = split(path)[0]
     if not isdir(dirpath):
         makedirs(dirpath)
-    torch.save(
-        {
-            "epoch": epoch,
-            "model_state_dict": model["local_model"].state_dict()
+    checkpoint = {
+        "epoch": epoch,
+        "model_state_dict": state_dict_to_cpu(
+            model["local_model"].state_dict()
             if args.train_federated
             else model.state_dict(),
-            "optim_state_dict": opt_state_dict,
-            "args": args,
-            "val_mean_std": val_mean_std,
-        },
-        path,
+            _pinned_buffers.setdefault("model", {}),
+        ),
+        "optim_state_dict": opt_state_dict,
+        "args": args,
+        "val_mean_std": val_mean_std,
+    }
+    _pending_saves.append(
+        _save_executor.submit(
+            torch.save, checkpoint, path, _use_new_zipfile_serialization=True
+        )
     )
@@ -43,6 +43,7 @@ from torchlib.utils import (
     MixUp,
     save_config_results,
     save_model,
+    wait_for_saves,
     test,
     train,
     train_federated,
@@ -194,10 +195,6 @@ def main(args, verbose=True, optuna_trial=None, cmd_args=None):
         cw = calc_class_weights(args, train_loader, num_classes)
         cw = cw.to(device)
 
-    scheduler = LearningRateScheduler(
-        args.epochs, np.log10(args.lr), np.log10(args.end_lr), restarts=args.restarts
-    )
-
     ## visdom
     vis_params = None
     if args.visdom:
@@ -387,6 +384,18 @@ def main(args, verbose=True, optuna_trial=None, cmd_args=None):
                 )
             )  # not possible to load previous optimizer if setting changed
         # args.incorporate_cmd_args(cmd_args)
+    # federated optimizers are recreated during training, so only the local
+    # optimizer is driven by a torch scheduler
+    scheduler = LearningRateScheduler(
+        args.epochs,
+        np.log10(args.lr),
+        np.log10(args.end_lr),
+        schedule_plan=args.lr_schedule,
+        restarts=args.restarts,
+        warmup_epochs=args.warmup_epochs,
+        T_mult=args.restart_mult,
+        optimizer=None if args.train_federated else optimizer,
+    )
     if args.train_federated:
         for m in model.values():
             m.to(device)
@@ -532,6 +541,7 @@ def main(args, verbose=True, optuna_trial=None, cmd_args=None):
         )
     )
     # load best model on val set
+    wait_for_saves()
     state = torch.load(best_model_file, map_location=device)
     if args.train_federated:
         model = model["local_model"]